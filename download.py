@@ -1,144 +1,494 @@
 #!/usr/bin/env python
 
 import datetime
+import json
+import os
 import pathlib
-import ssl
+import re
+import sqlite3
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from itertools import islice
 
 import feedparser  # Parses RSS feeds
 import listparser  # Parses OPML files
 import requests
-from six import reraise  # To make downloads easier
-from tinydb import Query
-from tinydb import TinyDB
-from tinydb.storages import JSONStorage
-from tinydb_serialization import SerializationMiddleware
-from tinydb_serialization.serializers import DateTimeSerializer
-from tenacity import retry, stop_after_attempt, RetryError
+from requests.adapters import HTTPAdapter
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential, RetryError
 from tqdm import tqdm
 
+# Downloads are bound by network latency rather than CPU, so use the same sizing as the stdlib default for I/O pools
+MAX_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+# Read/write episodes in large blocks to keep the number of Python-level calls and write syscalls down
+CHUNK_SIZE = 256 * 1024
+WRITE_BUFFER_SIZE = 1024 * 1024
+# Progress bars are only worth drawing for someone watching a terminal, and are refreshed every few chunks rather than
+# on each one, since every worker thread contends for tqdm's lock
+SHOW_PROGRESS = sys.stderr.isatty() and not os.environ.get("PODCASTS_NO_PROGRESS")
+PROGRESS_UPDATE_CHUNKS = 16
 
-@retry(stop=stop_after_attempt(3))
-def parse_feed(url: str):
+# Shared across all workers so that episodes hosted on the same CDN reuse pooled connections instead of a new TLS
+# handshake per download. Retries are left to tenacity.
+SESSION = requests.Session()
+SESSION.headers["User-Agent"] = "podcasts/0.1 (+https://github.com/garettmd/podcasts)"
+_adapter = HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS, max_retries=0)
+SESSION.mount("https://", _adapter)
+SESSION.mount("http://", _adapter)
+
+# We don't verify certificates (plenty of podcast hosts have broken ones), so silence urllib3's warnings about it once
+# here rather than on every (retried) call
+requests.packages.urllib3.disable_warnings()
+
+# Retry policy for anything that goes over the network. Reading from response.raw surfaces urllib3's own errors rather
+# than requests' wrapped ones, so both are retried.
+network_retry = retry(
+    stop=stop_after_attempt(3),
+    wait=wait_exponential(multiplier=1, max=10),
+    retry=retry_if_exception_type(
+        (requests.exceptions.RequestException, requests.packages.urllib3.exceptions.HTTPError)
+    ),
+)
+
+# Feeds last fetched longer ago than this are refreshed
+STALE_AFTER = datetime.timedelta(days=1)
+# Timestamps are stored in UTC, in the same form as SQLite's datetime(), so they compare correctly as text
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Bumped whenever the layout of a table changes, see open_db for the migrations
+SCHEMA_VERSION = 2
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS feeds (
+    title TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    last_updated TIMESTAMP,
+    etag TEXT,
+    modified TEXT
+);
+CREATE INDEX IF NOT EXISTS feeds_last_updated ON feeds (last_updated);
+CREATE TABLE IF NOT EXISTS entries (
+    feed_title TEXT NOT NULL,
+    guid TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    safe_title TEXT NOT NULL,
+    href TEXT NOT NULL,
+    PRIMARY KEY (feed_title, guid)
+);
+CREATE TABLE IF NOT EXISTS downloaded (
+    feed_title TEXT NOT NULL,
+    guid TEXT NOT NULL,
+    PRIMARY KEY (feed_title, guid)
+);
+CREATE TABLE IF NOT EXISTS opml_imports (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL
+);
+"""
+
+# Anything that isn't safe in a file name on all the filesystems we might be syncing to
+_UNSAFE_FILENAME_CHARS = re.compile(r"[^\w\-. ]+")
+
+
+def safe(name: str):
+    """
+    Turns a show or episode title into something usable as a file name
+    Truncated to 200 bytes rather than characters, since filesystems limit names to 255 bytes and non-ASCII letters
+    take several each. That leaves room for the ".mp3" extension and download_file's temporary ".<id>.part" suffix.
+    """
+    name = _UNSAFE_FILENAME_CHARS.sub("_", name).encode()[:200].decode(errors="ignore")
+    # FAT/exFAT, which most MP3 players use, reject names ending in a dot or space. Stripping those also takes care of
+    # "." and "..", which aren't file names at all.
+    return name.rstrip(". ") or "untitled"
+
+
+def slim_entry(entry):
+    """
+    Keeps only the parts of a feedparser entry needed to download an episode, or returns None if it has no audio.
+    Full entries carry show notes, HTML summaries and so on, which would otherwise all end up in the database.
+    """
+    for link in entry.get("links", []):
+        if link.get("type") in ["audio/mpeg"]:
+            href = link["href"]
+            title = entry.get("title", "")
+            guid = entry.get("id") or href
+            # Untitled episodes are named after their guid, so they don't all end up in the same file
+            return {"title": title, "safe_title": safe(title or guid), "guid": guid, "audio_href": href}
+    return None
+
+
+@network_retry
+def parse_feed(url: str, max_entries: int = None, etag: str = None, modified: str = None):
     """
-    Uses feedparser to download the RSS feed XML file
+    Downloads the RSS feed XML file through the shared session, and parses it with feedparser
+    Only the first `max_entries` episodes (all of them if None) are kept, in slimmed-down form.
+    `etag` and `modified` come from the previous fetch, and let the server answer with a 304 if nothing has changed, in
+    which case None is returned.
     """
-    # Disable SSL verification otherwise feedparser won't work
-    if hasattr(ssl, "_create_unverified_context"):
-        ssl._create_default_https_context = ssl._create_unverified_context
     print(f"Getting feed for {url}")
-    parsed_feed = feedparser.parse(url)
-    return parsed_feed
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if modified:
+        headers["If-Modified-Since"] = modified
+    response = SESSION.get(url, headers=headers, verify=False, timeout=10)
+    response.raise_for_status()
+    if response.status_code == 304:
+        return None
+    # Passing the headers along lets feedparser use the Content-Type charset, as it would have fetching the URL itself.
+    # feedparser copies them into a plain dict and looks them up in lower case, so they have to be lowered here.
+    response_headers = {name.lower(): value for name, value in response.headers.items()}
+    parsed_feed = feedparser.parse(response.content, response_headers=response_headers)
+    episodes = filter(None, (slim_entry(entry) for entry in parsed_feed["entries"]))
+    return {
+        "entries": list(islice(episodes, max_entries)),
+        "etag": response.headers.get("ETag"),
+        "modified": response.headers.get("Last-Modified"),
+    }
 
 
-@retry(stop=stop_after_attempt(3))
+def read_chunks(response):
+    """
+    Yields the body of a streamed response in chunks of up to CHUNK_SIZE bytes
+    Uncompressed bodies are read straight from the raw stream into one reused buffer, rather than through iter_content's
+    generator and a new bytes object per chunk. Each chunk is then a view of that buffer, only valid until the next one.
+    """
+    if response.headers.get("content-encoding", "identity").lower() != "identity":
+        # Decoding can return more than was asked for, which urllib3 1.x's readinto tries to fit by resizing the buffer,
+        # so compressed bodies are left to requests
+        yield from response.iter_content(chunk_size=CHUNK_SIZE)
+        return
+    response.raw.decode_content = False
+    view = memoryview(bytearray(CHUNK_SIZE))
+    received = 0
+    while True:
+        read = response.raw.readinto(view)
+        if not read:
+            break
+        received += read
+        yield view[:read]
+    # urllib3 1.x doesn't check that the whole body arrived, so a dropped connection would look like a finished download
+    expected = int(response.headers.get("content-length", 0))
+    if received < expected:
+        raise requests.packages.urllib3.exceptions.ProtocolError(
+            f"Connection closed after {received} of {expected} bytes"
+        )
+
+
+@network_retry
 def download_file(url, dest: pathlib.Path = None):
-    # Disable SSL warnings
-    requests.packages.urllib3.disable_warnings()
-    try:
-        response = requests.get(url, stream=True, verify=False, timeout=5)
-    except requests.exceptions.ReadTimeout as e:
-        print(
-            f"Getting timeout when trying to hit {url}. Error: {e}"
-        )  # TODO: Convert these types of print statements to loggers
-    total_size_in_bytes = int(response.headers.get("content-length", 0))
-    block_size = 8092
-    title = dest.stem
-    progress_bar = tqdm(
-        total=total_size_in_bytes,
-        unit="bytes",
-        unit_scale=True,
-        unit_divisor=block_size,
-        ncols=len(title) + 75,
-        desc=title,
-    )
+    """
+    Streams `url` to `dest`. Network and HTTP errors are raised, so that tenacity can retry them, and leave no file
+    behind.
+    """
+    response = SESSION.get(url, stream=True, verify=False, timeout=5)
+    progress_bar = None
     try:
         response.raise_for_status()
-        with open(dest, "wb") as f:
-            for chunk in response.iter_content(chunk_size=8092):
-                progress_bar.update(len(chunk))
-                f.write(chunk)
-    except requests.exceptions.HTTPError as e:
-        print(f"There was an issue downloading {url}. Error: {e}")
+        total_size_in_bytes = int(response.headers.get("content-length", 0))
+        title = dest.stem
+        if SHOW_PROGRESS:
+            progress_bar = tqdm(
+                total=total_size_in_bytes,
+                unit="bytes",
+                unit_scale=True,
+                unit_divisor=1024,
+                ncols=len(title) + 75,
+                desc=title,
+            )
+        started = time.monotonic()
+        written = reported = 0
+        # Write to a .part file and only move it into place once it's complete and on disk, so an interrupted download
+        # never looks like a finished episode. Every attempt gets its own, so cleaning up can't touch anyone else's.
+        part_path = dest.with_name(f"{dest.name}.{uuid.uuid4().hex[:8]}.part")
+        try:
+            with open(part_path, "xb", buffering=WRITE_BUFFER_SIZE) as f:
+                for reads, chunk in enumerate(read_chunks(response), 1):
+                    f.write(chunk)
+                    written += len(chunk)
+                    if progress_bar is not None and reads % PROGRESS_UPDATE_CHUNKS == 0:
+                        progress_bar.update(written - reported)
+                        reported = written
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(part_path, dest)
+        except BaseException:
+            part_path.unlink(missing_ok=True)
+            raise
+        if progress_bar is None:
+            print(f"Downloaded {title}: {written} bytes in {time.monotonic() - started:.1f}s")
+        else:
+            progress_bar.update(written - reported)
+    finally:
+        # Release the connection back to the pool even if we're interrupted mid-stream
+        response.close()
+        if progress_bar is not None:
+            progress_bar.close()
 
 
-def download_episode(entry, dir: pathlib.Path):
+def file_exists(path: pathlib.Path):
+    """
+    Like Path.is_file(), but treats names the filesystem can't represent (e.g. too long) as not existing
+    """
+    try:
+        return path.is_file()
+    except OSError:
+        return False
+
+
+def download_episode(entry, dir: pathlib.Path, downloaded: set, legacy_dir: pathlib.Path = None):
     """
     Downloads individual episode using chunking via requests
+    Episodes whose (feed title, guid) is in `downloaded` are skipped. Returns that pair once the episode is on disk, so
+    the caller can record it, or None otherwise. Guids are only unique within a feed, so they're always paired up.
+    `legacy_dir` is where versions before titles were sanitized would have saved the show's episodes.
     """
-    download_path = dir / f"{entry['title']}.mp3"
-    if download_path.exists():
+    key = (entry["feed_title"], entry["guid"])
+    if key in downloaded:
         print(f"{entry['title']} already downloaded.")
-        return
-    for link in entry["links"]:
-        if link["type"] in ["audio/mpeg"]:
-            print(f'Downloading {entry["title"]}')
-            try:
-                download_file(link["href"], download_path)
-            except RetryError:
-                print(f'Unable to download {link["title"]} after 3 tries')
+        return None
+    download_path = dir / f"{entry['safe_title']}.mp3"
+    # Episodes downloaded before guids were recorded are only known by their file, which may still have the unsanitized
+    # show and episode titles
+    existing_paths = [download_path]
+    if legacy_dir is not None:
+        existing_paths.append(legacy_dir / f"{entry['title']}.mp3")
+    if any(file_exists(path) for path in existing_paths):
+        print(f"{entry['title']} already downloaded.")
+        return key
+    print(f'Downloading {entry["title"]}')
+    try:
+        download_file(entry["audio_href"], download_path)
+    except RetryError as e:
+        print(f'Unable to download {entry["title"]} after 3 tries. Error: {e.last_attempt.exception()}')
+        return None
+    return key
 
 
-def download_feed(feed, out_dir: pathlib.Path, limit: int = 3):
+def download_feed(
+    feed, out_dir: pathlib.Path, executor: ThreadPoolExecutor, downloaded: set, claimed_paths: set, limit: int = 3
+):
     """
     Initiates downloads of a single feed (a show in Podcast parlance).
     This function merely coordinates calls to sub-functions which handle the actual downloading.
+    Episode downloads are submitted to `executor`, and the resulting futures are returned to the caller, mapped to their
+    entries. Episodes whose file name is already in `claimed_paths` (e.g. two episodes titled "Bonus") are skipped, so
+    only one worker ever writes to a given path.
     """
-    # feed_dir = cwd / ''.join(x if x.isalnum() else "_" for x in feed["title"])
-    feed_dir = out_dir / feed["title"].replace("/", "_")
-    if not feed_dir.exists():
-        feed_dir.mkdir(parents=True)
+    feed_dir = out_dir / safe(feed["title"])
+    feed_dir.mkdir(parents=True, exist_ok=True)
+    legacy_dir = out_dir / feed["title"].replace("/", "_")
+    downloads = {}
     for entry in islice(feed["entries"], 0, limit):
-        download_episode(entry, feed_dir)
+        download_path = feed_dir / f"{entry['safe_title']}.mp3"
+        if download_path in claimed_paths:
+            print(f"Skipping {entry['title']}, another episode is already being saved as {download_path.name}")
+            continue
+        claimed_paths.add(download_path)
+        downloads[executor.submit(download_episode, entry, feed_dir, downloaded, legacy_dir)] = entry
+    return downloads
+
+
+def open_db(path: pathlib.Path):
+    """
+    Opens the SQLite database holding feeds, their entries and downloaded episodes, creating the tables if needed
+    """
+    db = sqlite3.connect(path)
+    db.row_factory = sqlite3.Row
+    version = db.execute("PRAGMA user_version").fetchone()[0]
+    if version < 1:
+        # Entries are only a copy of what's in the feeds, so an outdated table is dropped and refetched, not migrated
+        db.execute("DROP TABLE IF EXISTS entries")
+    old_downloaded = version < 2 and db.execute("SELECT 1 FROM sqlite_master WHERE name = 'downloaded'").fetchone()
+    if old_downloaded:
+        db.execute("ALTER TABLE downloaded RENAME TO downloaded_v1")
+    db.executescript(SCHEMA)
+    with db:
+        if version < 1:
+            db.execute("UPDATE feeds SET last_updated = NULL, etag = NULL, modified = NULL")
+        if old_downloaded:
+            # Downloads used to be keyed by guid alone. Guids still in a feed's entries can be attributed to it, and
+            # anything else is picked up again by download_episode's file check.
+            db.execute(
+                """
+                INSERT OR IGNORE INTO downloaded (feed_title, guid)
+                SELECT entries.feed_title, entries.guid FROM downloaded_v1 JOIN entries USING (guid)
+                """
+            )
+            db.execute("DROP TABLE downloaded_v1")
+        db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    return db
+
+
+def import_legacy_feeds(db, json_path: pathlib.Path):
+    """
+    Copies the feed list out of the TinyDB feeds.json used before the SQLite database, if the database has no feeds yet
+    """
+    if not json_path.is_file() or db.execute("SELECT 1 FROM feeds LIMIT 1").fetchone():
+        return
+    try:
+        legacy_feeds = [
+            {"title": feed["title"], "url": feed["url"]} for feed in json.loads(json_path.read_text())["feeds"].values()
+        ]
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        print(f"Unable to read the feeds in {json_path}, re-import them with --import-opml. Error: {e!r}")
+        return
+    with db:
+        db.executemany("INSERT OR IGNORE INTO feeds (title, url) VALUES (:title, :url)", legacy_feeds)
+    print(f"Imported {len(legacy_feeds)} feeds from {json_path}")
+
+
+def load_feeds(db):
+    """
+    Returns every feed along with its stored entries, newest first
+    """
+    feeds = {feed["title"]: dict(feed, entries=[]) for feed in db.execute("SELECT * FROM feeds")}
+    entries = db.execute(
+        "SELECT feed_title, guid, title, safe_title, href AS audio_href FROM entries ORDER BY feed_title, position"
+    )
+    for entry in entries:
+        feeds[entry["feed_title"]]["entries"].append(dict(entry))
+    return list(feeds.values())
 
 
-def older_than_1_day(dt):
-    return dt is None or (datetime.datetime.utcnow() - dt).days > 1
+def store_entries(db, feed_title: str, entries):
+    """
+    Replaces the stored entries of a feed. Returns False without writing anything if they're unchanged.
+    """
+    stored = db.execute(
+        "SELECT guid, title, safe_title, href FROM entries WHERE feed_title = ? ORDER BY position", (feed_title,)
+    ).fetchall()
+    incoming = [(entry["guid"], entry["title"], entry["safe_title"], entry["audio_href"]) for entry in entries]
+    if [tuple(row) for row in stored] == incoming:
+        return False
+    db.execute("DELETE FROM entries WHERE feed_title = ?", (feed_title,))
+    db.executemany(
+        "INSERT OR IGNORE INTO entries (feed_title, guid, position, title, safe_title, href) VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            (feed_title, entry["guid"], position, entry["title"], entry["safe_title"], entry["audio_href"])
+            for position, entry in enumerate(entries)
+        ],
+    )
+    return True
 
 
-def update_feeds(feeds, max_entries_per_feed=5, force_updates=False):
+def update_feeds(db, executor: ThreadPoolExecutor, max_entries_per_feed=5, force_updates=False):
     """
     Initiate downloading and parsing all feeds
+    Feeds are fetched concurrently on `executor`, while the database is only written from the calling thread.
+    Returns the titles of the feeds whose entries changed.
     """
-    Feed = Query()
+    # Every feed updated in this run shares one timestamp
+    now = datetime.datetime.now(datetime.timezone.utc)
     if force_updates:
-        unfresh_feeds = feeds.all()
+        unfresh_feeds = db.execute("SELECT * FROM feeds").fetchall()
     else:
-        unfresh_feeds = feeds.search(Feed.last_updated.test(older_than_1_day))
+        # Binding the cutoff keeps the statement text constant, so sqlite3's statement cache can reuse it
+        cutoff = (now - STALE_AFTER).strftime(TIMESTAMP_FORMAT)
+        unfresh_feeds = db.execute(
+            "SELECT * FROM feeds WHERE last_updated IS NULL OR last_updated < ?", (cutoff,)
+        ).fetchall()
+    # The common case when run regularly: nothing to fetch, and nothing to write
+    if not unfresh_feeds:
+        return []
     parsed_feeds = []
-    for feed in unfresh_feeds:
-        entries = parse_feed(feed["url"])["entries"][:max_entries_per_feed]
-        feeds.update({"entries": entries, "last_updated": datetime.datetime.utcnow()}, Feed.title == feed["title"])
+    fetches = {
+        executor.submit(parse_feed, feed["url"], max_entries_per_feed, feed["etag"], feed["modified"]): feed
+        for feed in unfresh_feeds
+    }
+    # Wait for every fetch before writing, so all of the updates go to disk in a single transaction
+    fetched = []
+    for fetch in as_completed(fetches):
+        feed = fetches[fetch]
+        try:
+            fetched.append((feed, fetch.result()))
+        except RetryError as e:
+            # Leave the feed stale so it's tried again next run, without holding up the others
+            print(f'Unable to get feed for {feed["title"]} after 3 tries. Error: {e.last_attempt.exception()}')
+    last_updated = now.strftime(TIMESTAMP_FORMAT)
+    with db:
+        for feed, parsed_feed in fetched:
+            # A 304 means the feed hasn't changed since the last fetch, so the stored entries are still current
+            if parsed_feed is None:
+                db.execute("UPDATE feeds SET last_updated = ? WHERE title = ?", (last_updated, feed["title"]))
+                continue
+            db.execute(
+                "UPDATE feeds SET last_updated = ?, etag = ?, modified = ? WHERE title = ?",
+                (last_updated, parsed_feed["etag"], parsed_feed["modified"], feed["title"]),
+            )
+            if store_entries(db, feed["title"], parsed_feed["entries"]):
+                parsed_feeds.append(feed["title"])
     return parsed_feeds
 
 
 def parse_opml(file):
-    opml_feeds = [
-        {"title": feed["title"], "url": feed["url"], "entries": [], "last_updated": None}
-        for feed in listparser.parse(file)["feeds"]
-    ]
+    opml_feeds = [{"title": feed["title"], "url": feed["url"]} for feed in listparser.parse(file)["feeds"]]
     return opml_feeds
 
 
-def import_opml(feeds, file):
-    opml_feeds = parse_opml("podcasts_opml.xml")
-    for feed in opml_feeds:
-        feeds.upsert(feed, Query()["title"] == feed["title"])
+def import_opml(db, file, force=False):
+    """
+    Adds (or resets) the feeds listed in an OPML file. Files that haven't changed since they were last imported are
+    skipped, unless `force` is set.
+    """
+    if not pathlib.Path(file).is_file():
+        print(f"Unable to import {file}: no such file")
+        return
+    path = str(pathlib.Path(file).resolve())
+    mtime = os.stat(path).st_mtime
+    imported = db.execute("SELECT mtime FROM opml_imports WHERE path = ?", (path,)).fetchone()
+    if imported is not None and mtime <= imported["mtime"] and not force:
+        print(f"{file} hasn't changed since it was last imported")
+        return
+    opml_feeds = parse_opml(path)
+    with db:
+        for feed in opml_feeds:
+            # Re-importing a feed resets it, so that it's fetched in full on the next update
+            db.execute(
+                """
+                INSERT INTO feeds (title, url) VALUES (:title, :url)
+                ON CONFLICT (title) DO UPDATE SET url = excluded.url, last_updated = NULL, etag = NULL, modified = NULL
+                """,
+                feed,
+            )
+            db.execute("DELETE FROM entries WHERE feed_title = :title", feed)
+        db.execute(
+            "INSERT INTO opml_imports (path, mtime) VALUES (?, ?) "
+            "ON CONFLICT (path) DO UPDATE SET mtime = excluded.mtime",
+            (path, mtime),
+        )
 
 
 def main(args):
-    serialization = SerializationMiddleware(JSONStorage)
-    serialization.register_serializer(DateTimeSerializer(), "TinyDate")
-    db_path = args.output_dir / "feeds.json"
-    db = TinyDB(db_path, sort_keys=True, indent=4, separators=(",", ": "), storage=serialization)
-    feeds = db.table("feeds")
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    db = open_db(args.output_dir / "feeds.db")
+    import_legacy_feeds(db, args.output_dir / "feeds.json")
+    downloaded = {(episode["feed_title"], episode["guid"]) for episode in db.execute("SELECT * FROM downloaded")}
 
     if args.import_opml:
-        import_opml(feeds, args.import_opml)
+        import_opml(db, args.import_opml, force=args.force_import)
 
-    update_feeds(feeds, force_updates=args.force_updates)
-    for feed in feeds.all():
-        download_feed(feed, args.output_dir, args.max_episodes)
+    # A single pool for every feed and episode, so a slow server for one show doesn't hold up the others
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        update_feeds(db, executor, force_updates=args.force_updates)
+        downloads = {}
+        claimed_paths = set()
+        for feed in load_feeds(db):
+            downloads.update(
+                download_feed(feed, args.output_dir, executor, downloaded, claimed_paths, args.max_episodes)
+            )
+        for download in as_completed(downloads):
+            try:
+                key = download.result()
+            except Exception as e:
+                # Keep going, so that the episodes which did finish are still recorded
+                print(f'Unable to download {downloads[download]["title"]}. Error: {e!r}')
+                continue
+            if key is not None:
+                downloaded.add(key)
+                with db:
+                    db.execute("INSERT OR IGNORE INTO downloaded (feed_title, guid) VALUES (?, ?)", key)
 
 
 if __name__ == "__main__":
@@ -148,7 +498,14 @@ if __name__ == "__main__":
     parser.add_argument(
         "-i",
         "--import-opml",
-        help="Import a new list of feeds with an OPML file, exported from another service.",
+        help="Import a new list of feeds with an OPML file, exported from another service. Unchanged files are only "
+        "re-imported with --force-import.",
+    )
+    parser.add_argument(
+        "--force-import",
+        action="store_true",
+        help="Re-import the --import-opml file even if it hasn't changed. This resets every feed it lists, so they're "
+        "fetched in full again.",
     )
     parser.add_argument(
         "-f",
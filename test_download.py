@@ -0,0 +1,115 @@
+import gzip
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+from tenacity import RetryError, stop_after_attempt, wait_none
+
+import download
+
+# No encoding in the XML declaration, so the charset has to come from the Content-Type header
+FEED = """<?xml version="1.0"?>
+<rss version="2.0"><channel><title>Show</title>
+<item><title>{title}</title><guid>ep1</guid>
+<enclosure url="http://example.com/ep1.mp3" type="audio/mpeg"/></item>
+</channel></rss>
+"""
+
+
+@pytest.fixture
+def serve():
+    """
+    Serves `body` on a local HTTP server and returns its URL. `content_length` can be set larger than the body to
+    simulate a connection dropped mid-stream. The number of requests received is kept in `serve.requests`.
+    """
+    servers = []
+
+    def serve(body: bytes, content_type: str = "application/octet-stream", content_length: int = None, headers=None):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                serve.requests += 1
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body) if content_length is None else content_length))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = HTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_port}/"
+
+    serve.requests = 0
+    yield serve
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.mark.parametrize(
+    "title, charset",
+    [
+        ("Épisode 1: “Caffè”", "utf-8"),
+        # Not UTF-8 and not something feedparser would guess, so it only decodes if the header is honoured
+        ("Выпуск 1", "koi8-r"),
+    ],
+)
+def test_parse_feed_decodes_with_content_type_charset(serve, title, charset):
+    url = serve(FEED.format(title=title).encode(charset), f"application/rss+xml; charset={charset}")
+    parsed_feed = download.parse_feed(url)
+    assert [entry["title"] for entry in parsed_feed["entries"]] == [title]
+
+
+def test_download_file_moves_complete_download_into_place(serve, tmp_path):
+    body = bytes(range(256)) * 4096
+    dest = tmp_path / "Episode.mp3"
+    download.download_file(serve(body), dest)
+    assert dest.read_bytes() == body
+    assert list(tmp_path.iterdir()) == [dest]
+
+
+def test_download_file_decodes_compressed_body(serve, tmp_path):
+    # Compresses far below the read buffer size, so the decoded data is bigger than what each read asked for
+    body = b"\0" * (download.CHUNK_SIZE * 8)
+    dest = tmp_path / "Episode.mp3"
+    download.download_file(serve(gzip.compress(body), headers={"Content-Encoding": "gzip"}), dest)
+    assert dest.read_bytes() == body
+
+
+@pytest.mark.parametrize("attempts", [1, 3])
+def test_download_file_leaves_nothing_behind_when_stream_fails(serve, tmp_path, attempts):
+    # Promises more than it sends, so every attempt fails partway through the body
+    url = serve(b"x" * 1000, content_length=100_000)
+    download_file = download.download_file.retry_with(stop=stop_after_attempt(attempts), wait=wait_none())
+    with pytest.raises(RetryError):
+        download_file(url, tmp_path / "Episode.mp3")
+    assert serve.requests == attempts
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.parametrize(
+    "name, expected",
+    [
+        ("Ep 2: Later?", "Ep 2_ Later_"),
+        ("AC/DC", "AC_DC"),
+        ("Caffè", "Caffè"),
+        ("Trailing dots... ", "Trailing dots"),
+        ("", "untitled"),
+        (".", "untitled"),
+        ("..", "untitled"),
+    ],
+)
+def test_safe(name, expected):
+    assert download.safe(name) == expected
+
+
+def test_safe_truncates_to_200_bytes():
+    # Three bytes per character in UTF-8, so cutting at 200 characters would give a 600 byte name
+    name = download.safe("播客" * 300)
+    assert len(name.encode()) <= 200
+    assert name == "播客" * 33